@@ -17,6 +17,8 @@ import urllib.request
 from io import BytesIO
 import threading
 
+from prescription_pipeline import PrescriptionPipeline, initialize_medication_database
+
 # Set pytesseract path if needed (modify this for your system if tesseract is not in PATH)
 # pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'  # Windows
 # pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'  # Linux/Mac
@@ -29,7 +31,10 @@ class MedicalAnalysisTool:
         self.root.configure(bg="#f5f5f5")
         
         # Create medication database
-        self.med_database = self.initialize_medication_database()
+        self.med_database = initialize_medication_database()
+        
+        # Staged prescription analysis with memoized artifacts
+        self.prescription_pipeline = PrescriptionPipeline(self.med_database)
         
         # Initialize models
         self.initialize_models()
@@ -62,94 +67,6 @@ class MedicalAnalysisTool:
             self.status_label.config(text=f"Status: Error loading models - {str(e)}")
             self.log_message(f"Error loading models: {str(e)}")
     
-    def initialize_medication_database(self):
-        """Initialize a database of medications and their information"""
-        # This would typically be loaded from a proper database or API
-        # For demo purposes, we'll create a simple dictionary
-        
-        return {
-            "aspirin": {
-                "name": "Aspirin",
-                "purpose": "Pain reliever and anti-inflammatory",
-                "dosage": "Adults: 1-2 tablets every 4-6 hours",
-                "side_effects": "Stomach irritation, heartburn, nausea",
-                "warnings": "May cause bleeding. Avoid if allergic to NSAIDs.",
-                "interactions": "Blood thinners, other NSAIDs"
-            },
-            "lisinopril": {
-                "name": "Lisinopril",
-                "purpose": "ACE inhibitor for high blood pressure and heart failure",
-                "dosage": "Initially 10mg once daily, maintenance 20-40mg once daily",
-                "side_effects": "Dry cough, dizziness, headache",
-                "warnings": "May cause angioedema. Monitor kidney function.",
-                "interactions": "Potassium supplements, diuretics"
-            },
-            "metformin": {
-                "name": "Metformin",
-                "purpose": "Treatment for type 2 diabetes",
-                "dosage": "Start with 500mg twice daily, max 2550mg/day",
-                "side_effects": "Nausea, diarrhea, stomach discomfort",
-                "warnings": "May cause lactic acidosis in kidney dysfunction",
-                "interactions": "Alcohol, contrast dyes"
-            },
-            "atorvastatin": {
-                "name": "Atorvastatin",
-                "purpose": "Statin medication to lower cholesterol",
-                "dosage": "10-80mg once daily",
-                "side_effects": "Muscle pain, liver enzyme elevations",
-                "warnings": "Report unexplained muscle pain immediately",
-                "interactions": "Grapefruit juice, certain antibiotics"
-            },
-            "amoxicillin": {
-                "name": "Amoxicillin",
-                "purpose": "Antibiotic for bacterial infections",
-                "dosage": "250-500mg three times daily for 7-14 days",
-                "side_effects": "Diarrhea, nausea, rash",
-                "warnings": "May cause allergic reactions",
-                "interactions": "Certain blood thinners, birth control pills"
-            },
-            "levothyroxine": {
-                "name": "Levothyroxine",
-                "purpose": "Thyroid hormone replacement",
-                "dosage": "25-200mcg once daily on empty stomach",
-                "side_effects": "Headache, insomnia, nervousness at high doses",
-                "warnings": "Not for weight loss in normal thyroid function",
-                "interactions": "Calcium/iron supplements, antacids"
-            },
-            "omeprazole": {
-                "name": "Omeprazole",
-                "purpose": "Proton pump inhibitor for acid reflux and ulcers",
-                "dosage": "20mg once daily for 4-8 weeks",
-                "side_effects": "Headache, abdominal pain, diarrhea",
-                "warnings": "Long-term use may increase fracture risk",
-                "interactions": "Clopidogrel, certain HIV medications"
-            },
-            "sertraline": {
-                "name": "Sertraline",
-                "purpose": "SSRI antidepressant",
-                "dosage": "Start with 50mg once daily, maximum 200mg daily",
-                "side_effects": "Nausea, diarrhea, insomnia, sexual dysfunction",
-                "warnings": "May increase suicidal thoughts in young adults",
-                "interactions": "MAO inhibitors, NSAIDs, blood thinners"
-            },
-            "paracetamol": {
-                "name": "Paracetamol (Acetaminophen)",
-                "purpose": "Pain reliever and fever reducer",
-                "dosage": "Adults: 500-1000mg every 4-6 hours, max 4g/day",
-                "side_effects": "Generally minimal at recommended doses",
-                "warnings": "Overdose can cause severe liver damage",
-                "interactions": "Alcohol, certain liver medications"
-            },
-            "ibuprofen": {
-                "name": "Ibuprofen",
-                "purpose": "NSAID pain reliever and anti-inflammatory",
-                "dosage": "Adults: 200-400mg every 4-6 hours, max 3200mg/day",
-                "side_effects": "Stomach pain, heartburn, dizziness",
-                "warnings": "Long-term use increases risk of heart attack and stroke",
-                "interactions": "Aspirin, blood pressure medications, diuretics"
-            }
-        }
-        
     def create_widgets(self):
         """Create the UI elements"""
         # Title and description
@@ -233,6 +150,20 @@ class MedicalAnalysisTool:
         )
         self.process_prescription_btn.pack(pady=10)
         
+        # Correct extracted text button
+        self.edit_prescription_text_btn = Button(
+            left_panel,
+            text="Correct Extracted Text",
+            command=self.edit_prescription_text,
+            font=("Helvetica", 12),
+            bg="#3498db",
+            fg="white",
+            padx=10,
+            pady=5,
+            state=DISABLED
+        )
+        self.edit_prescription_text_btn.pack(pady=(0, 10))
+        
         # Right panel for results
         right_panel = Frame(self.prescription_tab, bg="#f5f5f5", width=500)
         right_panel.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -339,6 +270,10 @@ class MedicalAnalysisTool:
             # Enable the process button
             self.process_prescription_btn.config(state=NORMAL)
             
+            # Text extracted from a previous image no longer applies
+            self.prescription_text = ""
+            self.edit_prescription_text_btn.config(state=DISABLED)
+            
             self.log_message("Prescription image loaded. Click 'Analyze Prescription' to process.")
     
     def upload_pill_image(self):
@@ -371,34 +306,6 @@ class MedicalAnalysisTool:
         new_size = (int(width * ratio), int(height * ratio))
         return img.resize(new_size, Image.LANCZOS)
     
-    def preprocess_prescription_image(self, img_path):
-        """Preprocess the prescription image for better OCR results"""
-        # Open the image
-        img = Image.open(img_path)
-        
-        # Convert to grayscale
-        img = img.convert('L')
-        
-        # Increase contrast
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(2.0)
-        
-        # Apply some sharpening
-        img = img.filter(ImageFilter.SHARPEN)
-        
-        # Denoise
-        img = img.filter(ImageFilter.MedianFilter(size=3))
-        
-        # Increase size for better OCR
-        width, height = img.size
-        img = img.resize((width*2, height*2), Image.LANCZOS)
-        
-        # Save the preprocessed image temporarily
-        temp_path = "temp_prescription.png"
-        img.save(temp_path)
-        
-        return temp_path
-    
     def analyze_prescription(self):
         """Analyze the prescription image"""
         if not hasattr(self, 'prescription_file_path'):
@@ -411,71 +318,97 @@ class MedicalAnalysisTool:
         self.root.update()
         
         try:
-            # Preprocess the image
-            preprocessed_img_path = self.preprocess_prescription_image(self.prescription_file_path)
-            
-            # Perform OCR
+            # Run the pipeline (preprocessing, OCR, extraction and lookup),
+            # reusing any stages already computed for this image
             self.prescription_result_text.insert(END, "Extracting text from prescription...\n\n")
             self.root.update()
             
-            # Use pytesseract to extract text
-            text = pytesseract.image_to_string(preprocessed_img_path)
-            
-            # Clean up the text
-            text = self.clean_prescription_text(text)
+            text, details = self.prescription_pipeline.run(self.prescription_file_path)
+            self.prescription_text = text
             
             # Display the extracted text
             self.prescription_result_text.insert(END, "--- Raw Extracted Text ---\n")
             self.prescription_result_text.insert(END, text + "\n\n")
             
-            # Analyze the prescription content
-            self.analyze_prescription_content(text)
-            
-            # Clean up temp file
-            if os.path.exists(preprocessed_img_path):
-                os.remove(preprocessed_img_path)
+            # Display the prescription content
+            self.analyze_prescription_content(details)
             
+            self.edit_prescription_text_btn.config(state=NORMAL)
             self.status_label.config(text="Status: Prescription analysis completed")
             
         except Exception as e:
             self.prescription_result_text.insert(END, f"Error analyzing prescription: {str(e)}\n")
             self.status_label.config(text="Status: Error in prescription analysis")
     
-    def clean_prescription_text(self, text):
-        """Clean and normalize extracted text"""
-        # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Remove non-printable characters
-        text = ''.join(c for c in text if c.isprintable() or c in ['\n', '\t'])
-        
-        # Split into lines and remove empty lines
-        lines = [line.strip() for line in text.split('\n') if line.strip()]
+    def edit_prescription_text(self):
+        """Open a window to correct the extracted text and re-analyze it"""
+        editor = Toplevel(self.root)
+        editor.title("Correct Extracted Text")
+        editor.configure(bg="#f5f5f5")
+        
+        text_box = Text(editor, height=20, width=60, font=("Helvetica", 11), wrap=tk.WORD)
+        text_box.insert(END, getattr(self, 'prescription_text', ''))
+        text_box.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        def reanalyze():
+            corrected = text_box.get(1.0, END).strip()
+            editor.destroy()
+            self.reanalyze_prescription_text(corrected)
+        
+        Button(
+            editor,
+            text="Re-analyze Text",
+            command=reanalyze,
+            font=("Helvetica", 12),
+            bg="#2ecc71",
+            fg="white",
+            padx=10,
+            pady=5
+        ).pack(pady=(0, 10))
+    
+    def reanalyze_prescription_text(self, text):
+        """Re-analyze hand-corrected prescription text without rerunning OCR"""
+        self.status_label.config(text="Status: Re-analyzing corrected text...")
+        self.prescription_result_text.delete(1.0, END)
+        self.root.update()
         
-        return '\n'.join(lines)
+        try:
+            text, details = self.prescription_pipeline.run_from_text(text)
+            self.prescription_text = text
+            
+            self.prescription_result_text.insert(END, "--- Corrected Text ---\n")
+            self.prescription_result_text.insert(END, text + "\n\n")
+            
+            self.analyze_prescription_content(details)
+            
+            self.status_label.config(text="Status: Prescription analysis completed")
+            
+        except Exception as e:
+            self.prescription_result_text.insert(END, f"Error analyzing prescription: {str(e)}\n")
+            self.status_label.config(text="Status: Error in prescription analysis")
     
-    def analyze_prescription_content(self, text):
-        """Analyze the prescription content for medications, dosages, etc."""
+    def analyze_prescription_content(self, details):
+        """Display the analyzed prescription content (medications, dosages, etc.)"""
         self.prescription_result_text.insert(END, "--- Structured Analysis ---\n\n")
         
-        # Try to identify patient information
-        patient_info = self.extract_patient_info(text)
+        # Patient information
+        patient_info = details['patient']
         if patient_info:
             self.prescription_result_text.insert(END, "Patient Information:\n")
             for key, value in patient_info.items():
                 self.prescription_result_text.insert(END, f"- {key}: {value}\n")
             self.prescription_result_text.insert(END, "\n")
         
-        # Try to identify doctor information
-        doctor_info = self.extract_doctor_info(text)
+        # Doctor information
+        doctor_info = details['doctor']
         if doctor_info:
             self.prescription_result_text.insert(END, "Doctor Information:\n")
             for key, value in doctor_info.items():
                 self.prescription_result_text.insert(END, f"- {key}: {value}\n")
             self.prescription_result_text.insert(END, "\n")
         
-        # Try to identify medications
-        medications = self.extract_medications(text)
+        # Medications
+        medications = details['medications']
         if medications:
             self.prescription_result_text.insert(END, "Medications:\n")
             for med in medications:
@@ -489,10 +422,9 @@ class MedicalAnalysisTool:
                 if 'instructions' in med and med['instructions']:
                     self.prescription_result_text.insert(END, f"  Instructions: {med['instructions']}\n")
                 
-                # Look up medication information
-                med_info = self.lookup_medication(med['name'])
-                if med_info:
-                    self.prescription_result_text.insert(END, f"  Information: {med_info['purpose']}\n")
+                # Medication information from the lookup stage
+                if 'info' in med:
+                    self.prescription_result_text.insert(END, f"  Information: {med['info']['purpose']}\n")
                     
                 self.prescription_result_text.insert(END, "\n")
         else:
@@ -503,112 +435,6 @@ class MedicalAnalysisTool:
                                              "Always consult with a healthcare professional for accurate "
                                              "interpretation of prescriptions.\n")
     
-    def extract_patient_info(self, text):
-        """Extract patient information from the prescription text"""
-        patient_info = {}
-        
-        # Look for patient name pattern
-        name_match = re.search(r'(?:Patient[:\s]+|Name[:\s]+)([A-Za-z\s.]+)', text, re.IGNORECASE)
-        if name_match:
-            patient_info['name'] = name_match.group(1).strip()
-        
-        # Look for age pattern
-        age_match = re.search(r'(?:Age[:\s]+)(\d+)(?:\s+[Yy]ears?)?', text, re.IGNORECASE)
-        if age_match:
-            patient_info['age'] = age_match.group(1)
-        
-        # Look for date pattern
-        date_match = re.search(r'(?:Date[:\s]+)([0-9]{1,2}[/-][0-9]{1,2}[/-][0-9]{2,4})', text, re.IGNORECASE)
-        if date_match:
-            patient_info['date'] = date_match.group(1)
-        
-        return patient_info
-    
-    def extract_doctor_info(self, text):
-        """Extract doctor information from the prescription text"""
-        doctor_info = {}
-        
-        # Look for doctor name pattern
-        dr_match = re.search(r'(?:Dr\.?|Doctor)[:\s]*([A-Za-z\s.]+)', text, re.IGNORECASE)
-        if dr_match:
-            doctor_info['name'] = dr_match.group(1).strip()
-        
-        # Look for credentials
-        credentials_match = re.search(r'([A-Z.]+(?:\s*,\s*[A-Z.]+)*)', text)
-        if credentials_match:
-            credentials = credentials_match.group(1)
-            if credentials != doctor_info.get('name', ''):
-                doctor_info['credentials'] = credentials
-        
-        return doctor_info
-    
-    def extract_medications(self, text):
-        """Extract medications from the prescription text"""
-        medications = []
-        
-        # Split the text into lines for analysis
-        lines = text.split('\n')
-        
-        # Common medication patterns
-        rx_indicators = ['Rx', 'R/', '℞', 'Prescription']
-        med_section_started = False
-        
-        for i, line in enumerate(lines):
-            # Check if this line indicates the start of medications
-            if any(indicator in line for indicator in rx_indicators) or 'medication' in line.lower():
-                med_section_started = True
-                continue
-            
-            if not med_section_started:
-                continue
-            
-            # Skip lines that are likely not medications
-            if len(line.strip()) < 3 or re.match(r'^[\d\s.,]+$', line):
-                continue
-            
-            # Look for medication patterns
-            # This is a simplified approach - real prescriptions would need more complex parsing
-            parts = line.strip().split()
-            if not parts:
-                continue
-            
-            medication = {'name': parts[0]}
-            
-            # Try to extract dosage information
-            dosage_pattern = r'(\d+\s*(?:mg|mcg|g|ml|IU|%|tablet|cap))'
-            dosage_match = re.search(dosage_pattern, line, re.IGNORECASE)
-            if dosage_match:
-                medication['dosage'] = dosage_match.group(1)
-            
-            # Try to extract frequency
-            freq_pattern = r'(\d+\s*(?:times|x)\s*(?:a|per)\s*day|daily|twice daily|once daily|every\s*\d+\s*hours?|morning|night)'
-            freq_match = re.search(freq_pattern, line, re.IGNORECASE)
-            if freq_match:
-                medication['frequency'] = freq_match.group(1)
-            
-            # Try to extract duration
-            duration_pattern = r'(?:for|duration|take)\s*(\d+\s*(?:days?|weeks?|months?))'
-            duration_match = re.search(duration_pattern, line, re.IGNORECASE)
-            if duration_match:
-                medication['duration'] = duration_match.group(1)
-            
-            # Extract additional instructions
-            if "after" in line.lower() or "before" in line.lower() or "with" in line.lower():
-                medication['instructions'] = line
-            
-            # Check if this line is a continuation of the previous medication
-            if medications and len(parts) < 3 and not dosage_match and not freq_match:
-                # This might be additional instructions for the previous medication
-                if 'instructions' in medications[-1]:
-                    medications[-1]['instructions'] += " " + line
-                else:
-                    medications[-1]['instructions'] = line
-            else:
-                # This is a new medication
-                medications.append(medication)
-        
-        return medications
-    
     def identify_pill(self):
         """Identify the pill/tablet from the uploaded image"""
         if not hasattr(self, 'pill_file_path'):
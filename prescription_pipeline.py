@@ -0,0 +1,450 @@
+"""Staged prescription analysis shared by the GUI and batch reprocessing
+
+Only needs PIL and pytesseract, so an archive can be reprocessed without
+loading the GUI or the pill classification models.
+
+Stage artifacts accumulate in PIPELINE_CACHE_DIR as versions change; call
+PrescriptionPipeline.clear_cache() (or run reprocess_prescriptions.py with
+--clear-cache) to delete them.
+"""
+import os
+import re
+import copy
+import json
+import hashlib
+from collections import OrderedDict
+from PIL import Image, ImageEnhance, ImageFilter
+import pytesseract
+
+# Prescription analysis runs as a chain of stages, each with its own version.
+# Bump a stage's version when its logic changes; cached artifacts for that
+# stage and every stage after it are then recomputed, while earlier stages are
+# reused. Changes to the medication database contents invalidate the "lookup"
+# stage automatically. The one deliberate exception is the image stages:
+# decode and preprocess outputs are too large to keep, so whenever OCR has to
+# run (an "ocr" bump or a new image) they are recomputed as well.
+PIPELINE_STAGES = ["decode", "preprocess", "ocr", "clean", "extract", "lookup"]
+STAGE_VERSIONS = {
+    "decode": 1,
+    "preprocess": 1,
+    "ocr": 1,
+    "clean": 1,
+    "extract": 1,
+    "lookup": 1
+}
+
+# Text/JSON artifacts are saved to disk so they survive restarts, and the
+# most recently used ones are also kept in memory
+PIPELINE_CACHE_DIR = "pipeline_cache"
+PERSISTED_STAGES = {"ocr", "clean", "extract", "lookup"}
+STAGE_CACHE_SIZE = 256
+
+
+def initialize_medication_database():
+    """Initialize a database of medications and their information"""
+    # This would typically be loaded from a proper database or API
+    # For demo purposes, we'll create a simple dictionary
+    
+    return {
+        "aspirin": {
+            "name": "Aspirin",
+            "purpose": "Pain reliever and anti-inflammatory",
+            "dosage": "Adults: 1-2 tablets every 4-6 hours",
+            "side_effects": "Stomach irritation, heartburn, nausea",
+            "warnings": "May cause bleeding. Avoid if allergic to NSAIDs.",
+            "interactions": "Blood thinners, other NSAIDs"
+        },
+        "lisinopril": {
+            "name": "Lisinopril",
+            "purpose": "ACE inhibitor for high blood pressure and heart failure",
+            "dosage": "Initially 10mg once daily, maintenance 20-40mg once daily",
+            "side_effects": "Dry cough, dizziness, headache",
+            "warnings": "May cause angioedema. Monitor kidney function.",
+            "interactions": "Potassium supplements, diuretics"
+        },
+        "metformin": {
+            "name": "Metformin",
+            "purpose": "Treatment for type 2 diabetes",
+            "dosage": "Start with 500mg twice daily, max 2550mg/day",
+            "side_effects": "Nausea, diarrhea, stomach discomfort",
+            "warnings": "May cause lactic acidosis in kidney dysfunction",
+            "interactions": "Alcohol, contrast dyes"
+        },
+        "atorvastatin": {
+            "name": "Atorvastatin",
+            "purpose": "Statin medication to lower cholesterol",
+            "dosage": "10-80mg once daily",
+            "side_effects": "Muscle pain, liver enzyme elevations",
+            "warnings": "Report unexplained muscle pain immediately",
+            "interactions": "Grapefruit juice, certain antibiotics"
+        },
+        "amoxicillin": {
+            "name": "Amoxicillin",
+            "purpose": "Antibiotic for bacterial infections",
+            "dosage": "250-500mg three times daily for 7-14 days",
+            "side_effects": "Diarrhea, nausea, rash",
+            "warnings": "May cause allergic reactions",
+            "interactions": "Certain blood thinners, birth control pills"
+        },
+        "levothyroxine": {
+            "name": "Levothyroxine",
+            "purpose": "Thyroid hormone replacement",
+            "dosage": "25-200mcg once daily on empty stomach",
+            "side_effects": "Headache, insomnia, nervousness at high doses",
+            "warnings": "Not for weight loss in normal thyroid function",
+            "interactions": "Calcium/iron supplements, antacids"
+        },
+        "omeprazole": {
+            "name": "Omeprazole",
+            "purpose": "Proton pump inhibitor for acid reflux and ulcers",
+            "dosage": "20mg once daily for 4-8 weeks",
+            "side_effects": "Headache, abdominal pain, diarrhea",
+            "warnings": "Long-term use may increase fracture risk",
+            "interactions": "Clopidogrel, certain HIV medications"
+        },
+        "sertraline": {
+            "name": "Sertraline",
+            "purpose": "SSRI antidepressant",
+            "dosage": "Start with 50mg once daily, maximum 200mg daily",
+            "side_effects": "Nausea, diarrhea, insomnia, sexual dysfunction",
+            "warnings": "May increase suicidal thoughts in young adults",
+            "interactions": "MAO inhibitors, NSAIDs, blood thinners"
+        },
+        "paracetamol": {
+            "name": "Paracetamol (Acetaminophen)",
+            "purpose": "Pain reliever and fever reducer",
+            "dosage": "Adults: 500-1000mg every 4-6 hours, max 4g/day",
+            "side_effects": "Generally minimal at recommended doses",
+            "warnings": "Overdose can cause severe liver damage",
+            "interactions": "Alcohol, certain liver medications"
+        },
+        "ibuprofen": {
+            "name": "Ibuprofen",
+            "purpose": "NSAID pain reliever and anti-inflammatory",
+            "dosage": "Adults: 200-400mg every 4-6 hours, max 3200mg/day",
+            "side_effects": "Stomach pain, heartburn, dizziness",
+            "warnings": "Long-term use increases risk of heart attack and stroke",
+            "interactions": "Aspirin, blood pressure medications, diuretics"
+        }
+    }
+
+
+class PrescriptionPipeline:
+    """Staged prescription analysis with memoized intermediate artifacts
+    
+    Kept separate from the GUI so an archive of prescriptions can be
+    reprocessed without opening any windows.
+    """
+    
+    def __init__(self, med_database, cache_dir=PIPELINE_CACHE_DIR):
+        self.med_database = med_database
+        self.cache_dir = cache_dir
+        
+        # Hash of the database contents, folded into the lookup stage key.
+        # Create a new pipeline after changing the database.
+        self.database_key = hashlib.sha256(
+            json.dumps(med_database, sort_keys=True).encode('utf-8')).hexdigest()
+        
+        # Most recently used text/JSON artifacts, keyed by stage cache key
+        self.stage_cache = OrderedDict()
+        
+        # Number of times each stage was actually computed (cache misses)
+        self.stage_runs = {stage: 0 for stage in PIPELINE_STAGES}
+    
+    def decode_prescription_image(self, img_path):
+        """Decode the prescription image file into a PIL image"""
+        img = Image.open(img_path)
+        img.load()
+        return img
+    
+    def preprocess_prescription_image(self, img):
+        """Preprocess the prescription image for better OCR results"""
+        # Convert to grayscale
+        img = img.convert('L')
+        
+        # Increase contrast
+        enhancer = ImageEnhance.Contrast(img)
+        img = enhancer.enhance(2.0)
+        
+        # Apply some sharpening
+        img = img.filter(ImageFilter.SHARPEN)
+        
+        # Denoise
+        img = img.filter(ImageFilter.MedianFilter(size=3))
+        
+        # Increase size for better OCR
+        width, height = img.size
+        img = img.resize((width*2, height*2), Image.LANCZOS)
+        
+        return img
+    
+    def stage_keys(self, first_stage, input_key):
+        """Chain the cache keys for first_stage and every stage after it
+        
+        Each key hashes the stage name, its version and the previous key, so
+        changing a stage's version or input changes it and all later keys.
+        """
+        keys = {}
+        for stage in PIPELINE_STAGES[PIPELINE_STAGES.index(first_stage):]:
+            data = f"{stage}:{STAGE_VERSIONS[stage]}:{input_key}"
+            if stage == "lookup":
+                # A medication database update invalidates lookups on its own
+                data += f":{self.database_key}"
+            input_key = keys[stage] = hashlib.sha256(data.encode('utf-8')).hexdigest()
+        
+        return keys
+    
+    def load_stage_artifact(self, cache_path):
+        """Load a persisted artifact, returning None if it is missing or corrupt"""
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def save_stage_artifact(self, cache_path, artifact):
+        """Persist an artifact atomically so an interrupted write leaves no partial file
+        
+        Failing to write the cache (disk full, read-only directory) only
+        costs a recomputation later, so it never fails the analysis.
+        """
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(artifact, f)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    def clear_cache(self):
+        """Delete all memoized artifacts, in memory and in the cache directory"""
+        self.stage_cache.clear()
+        if not os.path.isdir(self.cache_dir):
+            return
+        
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(('.json', '.tmp')):
+                os.remove(os.path.join(self.cache_dir, file_name))
+    
+    def get_stage_artifact(self, stage, key, compute):
+        """Return the artifact for a stage, computing it only on a cache miss
+        
+        Cached artifacts are returned as copies so callers can modify them
+        without corrupting later runs.
+        """
+        if stage not in PERSISTED_STAGES:
+            # Image artifacts are large and only needed when OCR has to run
+            artifact = compute()
+            self.stage_runs[stage] += 1
+            return artifact
+        
+        if key in self.stage_cache:
+            self.stage_cache.move_to_end(key)
+            return copy.deepcopy(self.stage_cache[key])
+        
+        cache_path = os.path.join(self.cache_dir, f"{stage}_{key}.json")
+        artifact = self.load_stage_artifact(cache_path)
+        if artifact is None:
+            artifact = compute()
+            self.stage_runs[stage] += 1
+            self.save_stage_artifact(cache_path, artifact)
+        
+        self.stage_cache[key] = artifact
+        if len(self.stage_cache) > STAGE_CACHE_SIZE:
+            self.stage_cache.popitem(last=False)
+        
+        return copy.deepcopy(artifact)
+    
+    def run(self, img_path):
+        """Run the staged prescription pipeline on an image, reusing memoized artifacts
+        
+        Upstream stages are evaluated lazily and skipped entirely when a later
+        artifact is already cached.
+        """
+        with open(img_path, 'rb') as f:
+            source_key = hashlib.sha256(f.read()).hexdigest()
+        keys = self.stage_keys("decode", source_key)
+        
+        def decoded():
+            return self.get_stage_artifact(
+                "decode", keys["decode"], lambda: self.decode_prescription_image(img_path))
+        
+        def preprocessed():
+            return self.get_stage_artifact(
+                "preprocess", keys["preprocess"], lambda: self.preprocess_prescription_image(decoded()))
+        
+        def ocr():
+            return self.get_stage_artifact(
+                "ocr", keys["ocr"], lambda: pytesseract.image_to_string(preprocessed()))
+        
+        return self.run_text_stages(keys, ocr)
+    
+    def run_from_text(self, ocr_text):
+        """Run the pipeline on hand-corrected text, starting at the clean stage"""
+        manual_key = hashlib.sha256(f"manual:{ocr_text}".encode('utf-8')).hexdigest()
+        keys = self.stage_keys("clean", manual_key)
+        
+        return self.run_text_stages(keys, lambda: ocr_text)
+    
+    def run_text_stages(self, keys, ocr):
+        """Run the clean, extract and lookup stages on the (lazily computed) OCR text"""
+        text = self.get_stage_artifact(
+            "clean", keys["clean"], lambda: self.clean_prescription_text(ocr()))
+        details = self.get_stage_artifact(
+            "extract", keys["extract"], lambda: self.extract_prescription_details(text))
+        details = self.get_stage_artifact(
+            "lookup", keys["lookup"], lambda: self.lookup_prescription_medications(details))
+        
+        return text, details
+    
+    def reprocess(self, img_paths):
+        """Re-analyze a batch of prescription images, reusing cached stages
+        
+        Returns a dict mapping each image path to its (text, details) result.
+        """
+        return {img_path: self.run(img_path) for img_path in img_paths}
+    
+    def clean_prescription_text(self, text):
+        """Clean and normalize extracted text"""
+        # Remove excessive whitespace within lines, keeping line breaks
+        text = re.sub(r'[ \t\r\f\v]+', ' ', text)
+        
+        # Remove non-printable characters
+        text = ''.join(c for c in text if c.isprintable() or c in ['\n', '\t'])
+        
+        # Split into lines and remove empty lines
+        lines = [line.strip() for line in text.split('\n') if line.strip()]
+        
+        return '\n'.join(lines)
+    
+    def extract_prescription_details(self, text):
+        """Extract patient, doctor and medication details from the prescription text"""
+        return {
+            'patient': self.extract_patient_info(text),
+            'doctor': self.extract_doctor_info(text),
+            'medications': self.extract_medications(text)
+        }
+    
+    def extract_patient_info(self, text):
+        """Extract patient information from the prescription text"""
+        patient_info = {}
+        
+        # Look for patient name pattern
+        name_match = re.search(r'(?:Patient[: \t]+|Name[: \t]+)([A-Za-z .]+)', text, re.IGNORECASE)
+        if name_match:
+            patient_info['name'] = name_match.group(1).strip()
+        
+        # Look for age pattern
+        age_match = re.search(r'(?:Age[: \t]+)(\d+)(?:[ \t]+[Yy]ears?)?', text, re.IGNORECASE)
+        if age_match:
+            patient_info['age'] = age_match.group(1)
+        
+        # Look for date pattern
+        date_match = re.search(r'(?:Date[: \t]+)([0-9]{1,2}[/-][0-9]{1,2}[/-][0-9]{2,4})', text, re.IGNORECASE)
+        if date_match:
+            patient_info['date'] = date_match.group(1)
+        
+        return patient_info
+    
+    def extract_doctor_info(self, text):
+        """Extract doctor information from the prescription text"""
+        doctor_info = {}
+        
+        # Look for doctor name pattern
+        dr_match = re.search(r'(?:Dr\.?|Doctor)[: \t]*([A-Za-z .]+)', text, re.IGNORECASE)
+        if dr_match:
+            doctor_info['name'] = dr_match.group(1).strip()
+        
+        # Look for credentials
+        credentials_match = re.search(r'([A-Z.]+(?:[ \t]*,[ \t]*[A-Z.]+)*)', text)
+        if credentials_match:
+            credentials = credentials_match.group(1)
+            if credentials != doctor_info.get('name', ''):
+                doctor_info['credentials'] = credentials
+        
+        return doctor_info
+    
+    def extract_medications(self, text):
+        """Extract medications from the prescription text"""
+        medications = []
+        
+        # Split the text into lines for analysis
+        lines = text.split('\n')
+        
+        # Common medication patterns
+        rx_indicators = ['Rx', 'R/', '℞', 'Prescription']
+        med_section_started = False
+        
+        for i, line in enumerate(lines):
+            # Check if this line indicates the start of medications
+            if any(indicator in line for indicator in rx_indicators) or 'medication' in line.lower():
+                med_section_started = True
+                continue
+            
+            if not med_section_started:
+                continue
+            
+            # Skip lines that are likely not medications
+            if len(line.strip()) < 3 or re.match(r'^[\d\s.,]+$', line):
+                continue
+            
+            # Look for medication patterns
+            # This is a simplified approach - real prescriptions would need more complex parsing
+            parts = line.strip().split()
+            if not parts:
+                continue
+            
+            medication = {'name': parts[0]}
+            
+            # Try to extract dosage information
+            dosage_pattern = r'(\d+\s*(?:mg|mcg|g|ml|IU|%|tablet|cap))'
+            dosage_match = re.search(dosage_pattern, line, re.IGNORECASE)
+            if dosage_match:
+                medication['dosage'] = dosage_match.group(1)
+            
+            # Try to extract frequency
+            freq_pattern = r'(\d+\s*(?:times|x)\s*(?:a|per)\s*day|daily|twice daily|once daily|every\s*\d+\s*hours?|morning|night)'
+            freq_match = re.search(freq_pattern, line, re.IGNORECASE)
+            if freq_match:
+                medication['frequency'] = freq_match.group(1)
+            
+            # Try to extract duration
+            duration_pattern = r'(?:for|duration|take)\s*(\d+\s*(?:days?|weeks?|months?))'
+            duration_match = re.search(duration_pattern, line, re.IGNORECASE)
+            if duration_match:
+                medication['duration'] = duration_match.group(1)
+            
+            # Extract additional instructions
+            if "after" in line.lower() or "before" in line.lower() or "with" in line.lower():
+                medication['instructions'] = line
+            
+            # Check if this line is a continuation of the previous medication
+            if medications and len(parts) < 3 and not dosage_match and not freq_match:
+                # This might be additional instructions for the previous medication
+                if 'instructions' in medications[-1]:
+                    medications[-1]['instructions'] += " " + line
+                else:
+                    medications[-1]['instructions'] = line
+            else:
+                # This is a new medication
+                medications.append(medication)
+        
+        return medications
+    
+    def lookup_medication(self, name):
+        """Look up a medication in the database by name"""
+        return self.med_database.get(name.lower().strip(".,:;"))
+    
+    def lookup_prescription_medications(self, details):
+        """Attach medication database information to the extracted medications"""
+        medications = []
+        for med in details['medications']:
+            med = dict(med)
+            med_info = self.lookup_medication(med['name'])
+            if med_info:
+                med['info'] = med_info
+            medications.append(med)
+        
+        return dict(details, medications=medications)
@@ -0,0 +1,42 @@
+"""Reprocess an archive of prescription images without the GUI
+
+Usage:
+    python reprocess_prescriptions.py IMAGE [IMAGE ...]
+    python reprocess_prescriptions.py --clear-cache [IMAGE ...]
+
+Cached stage artifacts in pipeline_cache/ are reused, so after a parser or
+medication database update only the affected stages are recomputed. Artifacts
+from old stage versions are never pruned automatically; --clear-cache deletes
+the whole cache before processing.
+"""
+import argparse
+
+from prescription_pipeline import PrescriptionPipeline, initialize_medication_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocess prescription images without the GUI")
+    parser.add_argument("images", nargs="*", help="prescription image files")
+    parser.add_argument("--clear-cache", action="store_true",
+                        help="delete all cached stage artifacts first")
+    args = parser.parse_args()
+    if not args.images and not args.clear_cache:
+        parser.error("no prescription images given")
+
+    pipeline = PrescriptionPipeline(initialize_medication_database())
+    if args.clear_cache:
+        pipeline.clear_cache()
+        if not args.images:
+            return
+
+    results = pipeline.reprocess(args.images)
+    for img_path, (text, details) in results.items():
+        names = ", ".join(med['name'] for med in details['medications']) or "none"
+        print(f"{img_path}: medications: {names}")
+
+    print("Stages recomputed: " + ", ".join(
+        f"{stage}={runs}" for stage, runs in pipeline.stage_runs.items()))
+
+
+if __name__ == "__main__":
+    main()
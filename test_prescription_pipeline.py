@@ -0,0 +1,152 @@
+import os
+
+import pytest
+from PIL import Image
+
+import prescription_pipeline
+from prescription_pipeline import PIPELINE_STAGES, PrescriptionPipeline, initialize_medication_database
+
+OCR_TEXT = (
+    "Dr. Smith\n"
+    "Patient: John Doe\n"
+    "Age: 45\n"
+    "Rx\n"
+    "Aspirin 100mg once daily\n"
+    "Metformin 500mg twice daily for 30 days\n"
+)
+
+
+@pytest.fixture
+def ocr_calls(monkeypatch):
+    calls = []
+
+    def image_to_string(img):
+        calls.append(img)
+        return OCR_TEXT
+
+    monkeypatch.setattr(prescription_pipeline.pytesseract, "image_to_string", image_to_string)
+    return calls
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = str(tmp_path / "prescription.png")
+    Image.new("RGB", (40, 20), "white").save(path)
+    return path
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "cache")
+
+
+@pytest.fixture
+def pipeline(cache_dir):
+    return PrescriptionPipeline(initialize_medication_database(), cache_dir=cache_dir)
+
+
+def stage_runs_since(pipeline, before):
+    return {stage: pipeline.stage_runs[stage] - before[stage] for stage in PIPELINE_STAGES}
+
+
+def expected_runs(*stages):
+    return {stage: int(stage in stages) for stage in PIPELINE_STAGES}
+
+
+def test_run_extracts_and_looks_up_medications(pipeline, image_path, ocr_calls):
+    text, details = pipeline.run(image_path)
+
+    assert len(ocr_calls) == 1
+    assert text.split("\n")[:2] == ["Dr. Smith", "Patient: John Doe"]
+    assert details['patient']['name'] == "John Doe"
+    assert details['doctor']['name'] == "Smith"
+    assert [med['info']['name'] for med in details['medications']] == ["Aspirin", "Metformin"]
+    assert pipeline.stage_runs == expected_runs(*PIPELINE_STAGES)
+
+
+def test_second_run_recomputes_nothing(pipeline, cache_dir, image_path, ocr_calls):
+    first = pipeline.run(image_path)
+    before = dict(pipeline.stage_runs)
+
+    assert pipeline.run(image_path) == first
+    assert stage_runs_since(pipeline, before) == expected_runs()
+
+    # A new pipeline reuses the artifacts persisted on disk
+    fresh = PrescriptionPipeline(pipeline.med_database, cache_dir=cache_dir)
+    assert fresh.run(image_path) == first
+    assert fresh.stage_runs == expected_runs()
+    assert len(ocr_calls) == 1
+
+
+def test_extract_version_bump_reruns_only_extract_and_lookup(pipeline, image_path, ocr_calls, monkeypatch):
+    pipeline.run(image_path)
+    before = dict(pipeline.stage_runs)
+
+    monkeypatch.setitem(prescription_pipeline.STAGE_VERSIONS, "extract", 2)
+    pipeline.run(image_path)
+
+    assert stage_runs_since(pipeline, before) == expected_runs("extract", "lookup")
+
+
+def test_database_change_reruns_only_lookup(cache_dir, image_path, ocr_calls):
+    database = initialize_medication_database()
+    PrescriptionPipeline(database, cache_dir=cache_dir).run(image_path)
+
+    database["aspirin"] = dict(database["aspirin"], purpose="Updated purpose")
+    updated = PrescriptionPipeline(database, cache_dir=cache_dir)
+    _, details = updated.run(image_path)
+
+    assert updated.stage_runs == expected_runs("lookup")
+    assert details['medications'][0]['info']['purpose'] == "Updated purpose"
+
+
+def test_run_from_text_skips_image_stages(pipeline, ocr_calls):
+    _, details = pipeline.run_from_text("Rx\nIbuprofen 200mg every 6 hours")
+
+    assert ocr_calls == []
+    assert pipeline.stage_runs == expected_runs("clean", "extract", "lookup")
+    assert [med['info']['name'] for med in details['medications']] == ["Ibuprofen"]
+
+
+def test_corrupt_cache_file_is_a_cache_miss(pipeline, cache_dir, image_path, ocr_calls):
+    _, details = pipeline.run(image_path)
+    for file_name in os.listdir(cache_dir):
+        if file_name.startswith("extract_"):
+            with open(os.path.join(cache_dir, file_name), 'w', encoding='utf-8') as f:
+                f.write('{"patient": {"na')
+
+    fresh = PrescriptionPipeline(pipeline.med_database, cache_dir=cache_dir)
+
+    assert fresh.run(image_path)[1] == details
+    assert fresh.stage_runs == expected_runs("extract")
+
+
+def test_modifying_results_does_not_corrupt_cache(pipeline, image_path, ocr_calls):
+    _, details = pipeline.run(image_path)
+    details['medications'].append({'name': "Extra"})
+    details['patient']['name'] = "Someone Else"
+
+    _, details = pipeline.run(image_path)
+
+    assert [med['name'] for med in details['medications']] == ["Aspirin", "Metformin"]
+    assert details['patient']['name'] == "John Doe"
+
+
+def test_cache_write_failure_does_not_fail_analysis(pipeline, cache_dir, image_path, ocr_calls, monkeypatch):
+    def replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(prescription_pipeline.os, "replace", replace)
+    _, details = pipeline.run(image_path)
+
+    assert [med['name'] for med in details['medications']] == ["Aspirin", "Metformin"]
+    assert os.listdir(cache_dir) == []
+
+
+def test_clear_cache_deletes_artifacts(pipeline, cache_dir, image_path, ocr_calls):
+    pipeline.run(image_path)
+    pipeline.clear_cache()
+
+    assert os.listdir(cache_dir) == []
+    pipeline.run(image_path)
+    assert len(ocr_calls) == 2